@@ -8,21 +8,25 @@ __all__ = [
 ]
 
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import keyword
-from math import modf
+from math import log2, modf
 import os
-from typing import TYPE_CHECKING, Callable, Optional, List, Sequence, Union
+import re
+import threading
+from typing import TYPE_CHECKING, Callable, Optional, List, Sequence, Tuple, Union
 import warnings
 
+import numba as nb
 import numpy as np
 import riptide_cpp as rc
 
 from .rt_enum import TypeRegister, INVALID_DICT, NumpyCharTypes
-from .rt_numpy import arange, bool_to_fancy, crc32c, get_common_dtype, tile, empty
+from .rt_numpy import bool_to_fancy, crc32c, get_common_dtype, empty
 
 # Type-checking-only imports.
 if TYPE_CHECKING:
-    import re
     from .rt_dataset import Dataset
     from .rt_struct import Struct
 
@@ -32,7 +36,7 @@ def load_h5(
     filepath: Union[str, os.PathLike], name: str = '/',
     columns: Union[Sequence[str], 're.Pattern', Callable[..., Sequence[str]]] = '',
     format=None, fixblocks: bool = False, drop_short: bool = False,
-    verbose=0, **kwargs
+    lazy: bool = False, verbose=0, **kwargs
 ) -> Union['Dataset', 'Struct']:
     """
     Load from h5 file and flip hdf5.io objects to riptable structures.
@@ -57,6 +61,11 @@ def load_h5(
         True will transpose the rows when the H5 file are as ???, defaults to False.
     drop_short : bool
         Set to True to drop short rows and never return a Struct, defaults to False.
+    lazy : bool
+        Set to True to memory-map the datasets with h5py instead of reading them, defaults to False.
+        Contiguous, uncompressed datasets become read-only ``np.memmap`` arrays and are only read from
+        disk when touched; chunked or compressed datasets are still read in full.
+        Requires h5py; `format` and `kwargs` are ignored.
     verbose
         TODO
 
@@ -74,21 +83,33 @@ def load_h5(
     axis0 appears to be all column names - not sure what to do with this
     also what is axis1? should it get added like the other columns?
     """
-    import hdf5
-    if format is None:
-        format = hdf5.Format.NDARRAY
-
     if verbose > 0: print(f'starting h5 load {filepath}')
     # TEMP: Until hdf5.load() implements support for path-like objects, force conversion to str.
     filepath = os.fspath(filepath)
-    ws = hdf5.load(filepath, name=name, columns=columns, format=format, **kwargs)
-    if verbose > 0: print(f'finished h5 load {filepath}')
 
-    if isinstance(ws, dict):
-        if verbose > 0: print(f'h5 file loaded into dictionary. Possibly returning Dataset from dictionary, otherwise Struct.')
-        return _possibly_create_dataset(ws)
+    if lazy:
+        ws = _load_h5_lazy(filepath, name=name, columns=columns)
+        if verbose > 0: print(f'finished h5 lazy load {filepath}')
+
+    else:
+        import hdf5
+        if format is None:
+            format = hdf5.Format.NDARRAY
+
+        if drop_short and not fixblocks:
+            # find the short columns from the metadata so they are never read
+            keep = _h5_full_length_columns(filepath, name=name, columns=columns)
+            if keep:
+                columns = keep
 
-    ws = h5io_to_struct(ws)
+        ws = hdf5.load(filepath, name=name, columns=columns, format=format, **kwargs)
+        if verbose > 0: print(f'finished h5 load {filepath}')
+
+        if isinstance(ws, dict):
+            if verbose > 0: print(f'h5 file loaded into dictionary. Possibly returning Dataset from dictionary, otherwise Struct.')
+            return _possibly_create_dataset(ws)
+
+        ws = h5io_to_struct(ws)
 
     if fixblocks:
         ws = ws[0]
@@ -97,30 +118,120 @@ def load_h5(
             if k.endswith('_items'):
                 names = v.astype('U')
                 rows = ws[k[:-5]+'values']
-                t_dict = dict(zip(names, rows.transpose()))
-                for t_k, t_v in t_dict.items():
-                    final_dict[t_k] = t_v
+                # one column-major copy up front so every column is contiguous, instead of strided views
+                cols = np.ascontiguousarray(rows.transpose())
+                for i, t_k in enumerate(names):
+                    final_dict[str(t_k)] = cols[i]
         ws = TypeRegister.Struct(final_dict)
 
     if drop_short:
         # try to make a dataset
-        rownum_set = {len(ws[c]) for c in ws}
-        maxrow = max(rownum_set)
+        maxrow = 0
+        for v in ws.values():
+            rownum = len(v)
+            if rownum > maxrow:
+                maxrow = rownum
         print("drop short was set! max was ", maxrow)
         final_dict = {}
+        dropped = []
 
         # build a new dictionary with only columns of the max length
         for k, v in ws.items():
             if len(v) == maxrow:
                 final_dict[k] = v
             else:
-                warnings.warn(f"load_h5: drop_short, dropping col {k!r} with len {len(v)} vs {maxrow}")
+                dropped.append(f"{k!r} with len {len(v)}")
+
+        if dropped:
+            warnings.warn(f"load_h5: drop_short, dropping cols {', '.join(dropped)} vs {maxrow}")
 
         ws = TypeRegister.Dataset(final_dict)
 
     return ws
 
 
+#-----------------------------------------------------------------------------------------
+# re.Pattern only exists from python 3.7 on
+_RE_PATTERN_TYPE = type(re.compile(''))
+
+def _select_h5_columns(group, columns) -> List[str]:
+    """
+    Apply the `columns` argument of load_h5 to the members of an h5py group.
+    """
+    names = list(group.keys())
+    if isinstance(columns, str):
+        # empty string loads everything
+        return [n for n in names if n == columns] if columns else names
+    if isinstance(columns, _RE_PATTERN_TYPE):
+        return [n for n in names if columns.search(n)]
+    if callable(columns):
+        # groups have no dtype or shape
+        dtypes = [getattr(group[n], 'dtype', None) for n in names]
+        shapes = [getattr(group[n], 'shape', None) for n in names]
+        return list(columns(names, dtypes, shapes))
+    return [n for n in columns if n in group]
+
+#-----------------------------------------------------------------------------------------
+def _h5_full_length_columns(filepath: str, name: str = '/', columns='') -> Optional[List[str]]:
+    """
+    Names of the selected datasets under `name` that have the most rows, read from the h5 metadata only.
+    Returns None if h5py is not available or `name` is not a group.
+    """
+    try:
+        import h5py
+    except ImportError:
+        return None
+
+    with h5py.File(filepath, 'r') as f:
+        group = f[name]
+        if not isinstance(group, h5py.Group):
+            return None
+        nrows = {}
+        for itemname in _select_h5_columns(group, columns):
+            shape = getattr(group[itemname], 'shape', None)
+            # groups and scalars are never full length columns
+            nrows[itemname] = shape[0] if shape else 0
+
+    maxrow = max(nrows.values(), default=0)
+    return [k for k, v in nrows.items() if v == maxrow]
+
+#-----------------------------------------------------------------------------------------
+def _load_h5_lazy(filepath: str, name: str = '/', columns='') -> Union['Dataset', 'Struct']:
+    """
+    Open an h5 file with h5py and memory-map its datasets instead of reading them.
+
+    Only contiguous, uncompressed datasets without object fields can be mapped, see load_h5.
+    Record arrays are split into strided column views of the mapping.
+    """
+    import h5py
+
+    def map_dataset(dset):
+        offset = dset.id.get_offset()
+        # compression and other filters always imply a chunked layout
+        if dset.chunks is None and offset is not None and not dset.dtype.hasobject:
+            return np.memmap(filepath, mode='r', dtype=dset.dtype, shape=dset.shape, offset=offset)
+        return dset[()]
+
+    def walk(group, names):
+        itemdict = {}
+        for itemname in names:
+            item = group[itemname]
+            if isinstance(item, h5py.Group):
+                itemdict[itemname] = walk(item, list(item.keys()))
+            else:
+                arr = map_dataset(item)
+                if isinstance(arr, np.ndarray):
+                    arr = _possibly_convert_rec_array(arr, copy=False)
+                itemdict[itemname] = _possibly_create_dataset(arr)
+        return _possibly_create_dataset(itemdict)
+
+    with h5py.File(filepath, 'r') as f:
+        group = f[name]
+        if isinstance(group, h5py.Dataset):
+            arr = _possibly_convert_rec_array(map_dataset(group), copy=False)
+            return _possibly_create_dataset(arr)
+        return walk(group, _select_h5_columns(group, columns))
+
 #-----------------------------------------------------------------------------------------
 def _possibly_create_dataset(itemdict):
     """
@@ -141,12 +252,35 @@ def _possibly_create_dataset(itemdict):
     if isinstance(itemdict, np.ndarray):
         return itemdict
 
+    # skip the (much slower) exception raised by the Dataset constructor when it is certain to fail:
+    # nested containers, or arrays of different lengths. Lists, scalars and arrays of length 1
+    # are left to the constructor, which converts or expands them.
+    lengths = set()
+    for v in itemdict.values():
+        if isinstance(v, (dict, tuple, TypeRegister.Struct)):
+            return TypeRegister.Struct(itemdict)
+        if isinstance(v, np.ndarray) and v.ndim > 0 and len(v) != 1:
+            lengths.add(len(v))
+    if len(lengths) > 1:
+        return TypeRegister.Struct(itemdict)
+
     try:
         result = TypeRegister.Dataset(itemdict)
     except:
         result = TypeRegister.Struct(itemdict)
     return result
 
+#-----------------------------------------------------------------------------------------
+_RESERVED_KWS = frozenset(keyword.kwlist)
+# filled on first use, Dataset is not registered yet when this module is imported
+_DATASET_ATTRS: Optional[frozenset] = None
+
+def _get_dataset_attrs() -> frozenset:
+    global _DATASET_ATTRS
+    if _DATASET_ATTRS is None:
+        _DATASET_ATTRS = frozenset(dir(TypeRegister.Dataset))
+    return _DATASET_ATTRS
+
 #-----------------------------------------------------------------------------------------
 def _possibly_escape_colname(parent_name, container, name):
     """
@@ -158,13 +292,13 @@ def _possibly_escape_colname(parent_name, container, name):
     old = name
     while name.startswith('_'):
         name = name[1:]
-    if name in keyword.kwlist:
+    if name in _RESERVED_KWS:
         name = name + '_'
         while(name in container):
             name = name + '_'
         warnings.warn(f"changed name {old} to {name} in {parent_name}")
     # capitalize names of existing attributes in dataset
-    elif name in dir(TypeRegister.Dataset):
+    elif name in _get_dataset_attrs():
         old = name
         name = name.capitalize()
         warnings.warn(f"changed name {old} to {name} in {parent_name}")
@@ -172,53 +306,59 @@ def _possibly_escape_colname(parent_name, container, name):
     return name
 
 #-----------------------------------------------------------------------------------------
-def _possibly_convert_rec_array(item, parallel=True):
+def _possibly_convert_rec_array(item, copy=True):
     """
     h5 often loads data into a numpy record array (void type). Flip these before converting to a dataset.
+
+    When `copy` is False, no column-major copy is made; each column is returned as a strided view
+    into the record array (sharing its memory) instead.
     """
     if item.dtype.char == 'V':
-        warnings.warn(f"Converting numpy record array. Performance may suffer.")
-        # flip row-major to column-major
         d={}
-        if parallel:
-            offsets=[]
-            arrays=np.empty(len(item.dtype.fields), dtype='O')
-            arrlen = len(item)
-            count =0
-            for name, v in item.dtype.fields.items():
-                offsets.append(v[1])
-                arr= empty(arrlen, dtype=v[0])
-                arrays[count] = arr
-                count += 1
-                # build dict of names and new arrays
-                d[name] = arr
-            #print("offsets", offsets, arrays)
-            # Call new routine to convert
-            rc.RecordArrayToColMajor(item, np.asarray(offsets, dtype=np.int64), arrays);
-
-        else:
-            # old way
+        if not copy:
+            # field access is already an offset+stride view, nothing gets allocated
             for name in item.dtype.names:
-                d[name] = item[:][name].copy()
+                d[name] = item[name]
+            return d
+
+        warnings.warn(f"Converting numpy record array. Performance may suffer.")
+        # flip row-major to column-major
+        fields = item.dtype.fields
+        names = item.dtype.names
+        offsets = np.empty(len(names), dtype=np.int64)
+        arrays = np.empty(len(names), dtype='O')
+        arrlen = len(item)
+        for i, name in enumerate(names):
+            fielddtype, offsets[i] = fields[name][:2]
+            arr = empty(arrlen, dtype=fielddtype)
+            arrays[i] = arr
+            # build dict of names and new arrays
+            d[name] = arr
+
+        # Call new routine to convert
+        rc.RecordArrayToColMajor(item, offsets, arrays)
         return d
     return item
 
 #-----------------------------------------------------------------------------------------
-def h5io_to_struct(io):
+_HDF5_IO_MODULE = 'hdf5.io'
+
+def h5io_to_struct(io, copy=True):
     """
     Utility for crawling/flipping hdf5.io objects to Dataset/Struct.
     Will convert row-major numpy structured arrays to column-major.
+    Set `copy` to False to return the columns of structured arrays as zero-copy strided views instead.
 
     So far I've encountered hdf5.io. and hdf5.io.labels. It's a massive module.
     If anyone has use cases please send them my way, thanks - Sam Kachel
     """
     if isinstance(io, np.ndarray):
         if io.dtype.char == 'V':
-            io = _possibly_convert_rec_array(io)
+            io = _possibly_convert_rec_array(io, copy=copy)
         else:
             print('Loaded a single numpy array from h5. Returning struct of single array.')
         return _possibly_create_dataset(io)
-    if io.__module__ != 'hdf5.io':
+    if io.__module__ != _HDF5_IO_MODULE:
         raise TypeError(f"This routine attempts to interpret H5 data from classes in the hdf5.io module. Got {io.__module__} module instead.")
     itemdict = {}
     for itemname in dir(io):
@@ -226,7 +366,7 @@ def h5io_to_struct(io):
             item = getattr(io, itemname)
             # need to check for record array
             if isinstance(item, np.ndarray):
-                item = _possibly_convert_rec_array(item)
+                item = _possibly_convert_rec_array(item, copy=copy)
                 item = _possibly_create_dataset(item)
                 itemdict[itemname] = item
 
@@ -244,10 +384,10 @@ def h5io_to_struct(io):
                 itemdict[itemname] = _possibly_create_dataset(itemdict[itemname])
 
             # crawl the h5io object
-            elif item.__module__ == 'hdf5.io':
+            elif item.__module__ == _HDF5_IO_MODULE:
                 if item.__class__.__name__ == 'Categorical':
                     print(f"FOUND A CATEGORICAL: {itemname}\nPlease let Sam Kachel know where this file is.")
-                itemdict[itemname] = h5io_to_struct(item)
+                itemdict[itemname] = h5io_to_struct(item, copy=copy)
 
             else:
                 itemdict[itemname] = item
@@ -280,14 +420,16 @@ def findTrueWidth(string):
     """
     # Find the length of a byte string (without the trailing zeros)
     # the input must be dtype=np.int8, use np.frombuffer()
-    width = string.shape[0]
-    trailing = 0
-    for i in reversed(range(width)):
-        if string[i]:
-            break
-        else:
-            trailing+=1
-    return width-trailing
+    return _find_true_width_nb(string)
+
+#-----------------------------------------------------------------------------------------
+@nb.jit(nopython=True, cache=True, boundscheck=False)
+def _find_true_width_nb(string):
+    # called once per row from string matching, so keep the interpreter out of the scan
+    for i in range(string.shape[0] - 1, -1, -1):
+        if string[i] != 0:
+            return i + 1
+    return 0
 
 def merge_prebinned(key1: np.ndarray, key2: np.ndarray, val1, val2, totalUniqueSize):
     """
@@ -349,23 +491,26 @@ def normalize_keys(key1, key2, verbose =False):
                     key = [key]
                 else:
                     # Try to convert to a numpy array
-                    key = [np.asanyarray(key)]
+                    key = [np.asarray(key)]
             else:
                 # possible multi key path
                 # check first value to see if scalar - if it is assume user passed in a list of scalars
                 if np.isscalar(key[0]):
-                    key = [np.asanyarray(key)]
+                    key = [np.asarray(key)]
             return key
         else:
             # extract the value in the dictlike object
             return list(key.values())
 
+    Categorical = TypeRegister.Categorical
+    as_fa_type = TypeRegister.MathLedger._AS_FA_TYPE
+
     def possibly_convert(arr, common_dtype):
         # upcast if need to
         if arr.dtype.num != common_dtype.num:
             try:
                 # perform a safe conversion understanding sentinels
-                arr = TypeRegister.MathLedger._AS_FA_TYPE(arr, common_dtype.num)
+                arr = as_fa_type(arr, common_dtype.num)
             except Exception:
                 # try numpy conversion
                 arr = arr.astype(common_dtype)
@@ -386,9 +531,17 @@ def normalize_keys(key1, key2, verbose =False):
     # convert to common dtype
     for arr1, arr2 in zip(key1, key2):
 
+        iscat = isinstance(arr1, Categorical) or isinstance(arr2, Categorical)
+
+        # common case: nothing to align and nothing to convert
+        if not iscat and arr1.dtype is arr2.dtype:
+            arrays1.append(arr1)
+            arrays2.append(arr2)
+            continue
+
         # if either one is Categorical or both are, make sure they are aligned
-        if isinstance(arr1,TypeRegister.Categorical) or isinstance(arr2,TypeRegister.Categorical):
-            arr1, arr2 = TypeRegister.Categorical.align([arr1, arr2])
+        if iscat:
+            arr1, arr2 = Categorical.align([arr1, arr2])
             # even if categoricals were aligned we might have int16 vs int32 (so fall thru to check)
 
         # possibly convert common numpy dtypes
@@ -493,24 +646,31 @@ def _mbget_2dims(arr, idx):
     ncols = arr.shape[1]
     final_shape = (nrows, ncols)
 
-    # expand index array
-    # possible optimization: multiply on the smaller one first?
-    expanded_idx = np.repeat(idx, ncols) * ncols
-    expanded_idx += tile(arange(ncols), nrows)
+    if np.isfortran(arr):
+        # gather in column-major coordinates so neither the input nor the result gets copied
+        # to flip layout: ravel(order='K') and reshape(order='F') are both views for fortran arrays
+        arrrows = arr.shape[0]
+        expanded_idx = np.array(idx, dtype=np.int64)
+        # columns are arrrows apart, so out-of-range rows would land in the next column;
+        # wrap negative rows, then push any remaining invalid row past the end of the flattened array
+        expanded_idx[expanded_idx < 0] += arrrows
+        expanded_idx[(expanded_idx < 0) | (expanded_idx >= arrrows)] = arr.size
+        expanded_idx = (np.arange(ncols, dtype=np.int64)[:, None] * arrrows + expanded_idx).ravel()
 
-    # in as fortran
-    restore_fortran = np.isfortran(arr)
+        result = mbget(arr.ravel(order='K'), expanded_idx)
+        result = result.reshape(final_shape, order='F')
 
-    # flips to C-contiguous
-    arr = arr.ravel()
+    else:
+        # expand index array
+        # multiply on the smaller (nrows, 1) array first, then a single broadcast add writes the full index once
+        expanded_idx = (np.asarray(idx, dtype=np.int64)[:, None] * ncols + np.arange(ncols, dtype=np.int64)).ravel()
 
-    # send 1-dim raveled through
-    result = mbget(arr, expanded_idx)
+        # flips to C-contiguous (copies when arr is not contiguous)
+        arr = arr.ravel()
 
-    result = result.reshape(final_shape)
-    # performance warning: array gets copied during ravel, and copied back here if in fortran layout
-    if restore_fortran:
-        result = np.asfortranarray(result)
+        # send 1-dim raveled through
+        result = mbget(arr, expanded_idx)
+        result = result.reshape(final_shape)
 
     return result.view(TypeRegister.FastArray)
 
@@ -670,6 +830,178 @@ def interpolate(data, floatIndex):
       return data[whole], whole
 
    return (1.0 - frac) * data[whole] + frac * data[whole + 1], whole
+
+#----------------------------------------------------------
+def _interpolate_kth(q: List[float], cvalidm1: int) -> List[int]:
+    """
+    Positions that interpolate() reads for each quantile in `q`, for an array of length ``cvalidm1 + 1``.
+    Only these positions need to be in sorted order, so they can be passed as `kth` to ``np.partition``.
+    """
+    kth = set()
+    for percent in q:
+        frac, whole = modf(percent * cvalidm1)
+        whole = int(whole)
+        for k in (whole, whole + 1) if frac else (whole,):
+            # out of range quantiles are handled by interpolate()
+            if 0 <= k <= cvalidm1:
+                kth.add(k)
+    return sorted(kth)
+
+#----------------------------------------------------------
+def _partial_sort(arr: np.ndarray, kth: List[int]) -> None:
+    """
+    Inplace, put the positions in `kth` (sorted, unique) in their sorted order.
+    Partitions when only a few positions are needed, otherwise a full sort is cheaper.
+    """
+    n = len(arr)
+    if not kth:
+        return
+    if n > 2 and len(kth) <= n / log2(n):
+        arr.partition(kth)
+    else:
+        arr.sort()
+
+#----------------------------------------------------------
+def _quantiles_from_sorted_or_partitioned(part: np.ndarray, q: List[float], out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Interpolated quantiles `q` of `part` (no invalids), the same values as numpy.percentile.
+    `part` must be sorted, or partitioned on (a superset of) ``_interpolate_kth(q, len(part) - 1)``,
+    so one partition serves all the requested quantiles. Results go in `out` when given.
+    """
+    if out is None:
+        out = empty(len(q), dtype=np.float64)
+    cvalidm1 = len(part) - 1
+    for i, percent in enumerate(q):
+        out[i], _ = interpolate(part, percent * cvalidm1)
+    return out
+
+#----------------------------------------------------------
+@nb.jit(nopython=True, nogil=True, cache=True)
+def _copy_valid_float_nb(arr, out):
+    cvalid = 0
+    for i in range(arr.shape[0]):
+        x = arr[i]
+        # false only for nan
+        if x == x:
+            out[cvalid] = x
+            cvalid += 1
+    return cvalid
+
+@nb.jit(nopython=True, nogil=True, cache=True)
+def _copy_valid_int_nb(arr, out, inv):
+    cvalid = 0
+    for i in range(arr.shape[0]):
+        x = arr[i]
+        if x != inv:
+            out[cvalid] = x
+            cvalid += 1
+    return cvalid
+
+def _copy_valid(arr: np.ndarray) -> np.ndarray:
+    """
+    Returns a copy of `arr` with the nans/invalids removed.
+
+    For plain float and integer arrays the validity test, the count and the copy are done in
+    a single pass instead of building an isnotnan() mask, reducing it, then compressing with it.
+    Subclasses and non-native byte orders (which numba cannot type) keep going through isnotnan().
+    """
+    if type(arr) in (TypeRegister.FastArray, np.ndarray) and arr.ndim == 1 and arr.dtype.isnative:
+        dtype = arr.dtype
+        if dtype.char in 'fd':
+            out = empty(len(arr), dtype=dtype)
+            cvalid = _copy_valid_float_nb(arr.view(np.ndarray), out.view(np.ndarray))
+            return out[:cvalid]
+
+        if dtype.char in NumpyCharTypes.AllInteger:
+            # riptable integer sentinels: the min of the signed types, the max of the unsigned types
+            info = np.iinfo(dtype)
+            inv = dtype.type(info.min if dtype.char in NumpyCharTypes.Integer else info.max)
+            out = empty(len(arr), dtype=dtype)
+            cvalid = _copy_valid_int_nb(arr.view(np.ndarray), out.view(np.ndarray), inv)
+            return out[:cvalid]
+
+    ivalid = arr.isnotnan()
+    if ivalid.sum() == len(arr):
+        # use entire array, make a fast copy
+        return arr.copy()
+    # pick a subset removing the invalid (also makes the copy)
+    return arr[ivalid]
+
+#----------------------------------------------------------
+@nb.jit(nopython=True, parallel=True, cache=True)
+def _mean_m2_nb(arr, nchunks):
+    # Welford per chunk, then the chunks are merged with Chan's pairwise update
+    n = arr.shape[0]
+    chunksize = (n + nchunks - 1) // nchunks
+    counts = np.zeros(nchunks, dtype=np.int64)
+    means = np.zeros(nchunks, dtype=np.float64)
+    m2s = np.zeros(nchunks, dtype=np.float64)
+    for c in nb.prange(nchunks):
+        cnt = 0
+        mean = 0.0
+        m2 = 0.0
+        for i in range(c * chunksize, min((c + 1) * chunksize, n)):
+            x = np.float64(arr[i])
+            cnt += 1
+            delta = x - mean
+            mean += delta / cnt
+            m2 += delta * (x - mean)
+        counts[c] = cnt
+        means[c] = mean
+        m2s[c] = m2
+
+    cnt = 0
+    mean = 0.0
+    m2 = 0.0
+    for c in range(nchunks):
+        if counts[c] == 0:
+            continue
+        total = cnt + counts[c]
+        delta = means[c] - mean
+        mean += delta * counts[c] / total
+        m2 += m2s[c] + delta * delta * cnt * counts[c] / total
+        cnt = total
+    return mean, m2
+
+@nb.jit(nopython=True, nogil=True, cache=True)
+def _mean_m2_serial_nb(arr):
+    cnt = 0
+    mean = 0.0
+    m2 = 0.0
+    for i in range(arr.shape[0]):
+        x = np.float64(arr[i])
+        cnt += 1
+        delta = x - mean
+        mean += delta / cnt
+        m2 += delta * (x - mean)
+    return mean, m2
+
+def _mean_std(arr: np.ndarray):
+    """
+    Mean and std (ddof=1, same as FastArray.std) of an array without invalids, in a single pass over the data.
+    The std comes straight from the M2 of the Welford kernel; there is no second pass over the deviations.
+    """
+    if arr.dtype.char == '?':
+        # booleans are summed as 0/1
+        arr = arr.view(np.uint8)
+    # numba cannot type non-native byte orders
+    if arr.dtype.isnative and (arr.dtype.char in 'fd' or arr.dtype.char in NumpyCharTypes.AllInteger):
+        n = len(arr)
+        # small arrays are not worth splitting across threads. Worker threads (see _describe_dataset_threaded)
+        # are already parallel across columns, and must not start numba's threading layer themselves.
+        nchunks = n // 65536
+        if nchunks > 1 and threading.current_thread() is threading.main_thread():
+            nchunks = min(nb.get_num_threads(), nchunks)
+            mean, m2 = _mean_m2_nb(arr.view(np.ndarray), nchunks)
+        else:
+            mean, m2 = _mean_m2_serial_nb(arr.view(np.ndarray))
+        # an inf turns the Welford update into inf - inf = nan (the mean of [inf, 1] would come out nan),
+        # and once the mean has seen one it can never become finite again, so checking the result is enough
+        if np.isfinite(mean) and np.isfinite(m2):
+            std = np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+            return mean, std
+    return arr.mean(), arr.std()
+
 #----------------------------------------------------------
 def quantile(arr: Optional[np.ndarray], q:List[float]=None):
     """
@@ -686,108 +1018,83 @@ def quantile(arr: Optional[np.ndarray], q:List[float]=None):
     """
     if q is None:
         q = [0.10, 0.25, 0.50, 0.75, 0.90]
-    ivalid = arr.isnotnan()
-    count = len(arr)
-    cvalid = ivalid.sum()
+    # copy of the valid values
+    valid = _copy_valid(arr)
+    cvalid = len(valid)
     if cvalid == 0:
-        retvals = [np.nan] * len(q)
+        retvals = TypeRegister.FastArray([np.nan] * len(q), dtype=np.float64)
     else:
-        # sort will put nans at end
-        # for signed integer sentinels, they will be in the beginning
-
-        # make a fast copy first
-        arr_sort = arr.copy()
-
-        #inplace sort
-        arr_sort.sort()
-
-        if cvalid == count:
-            # use entire array
-            valid = arr_sort
-            notvalid = 0
-        else:
-            # pick a subset removing the invalid
-            notvalid = count - cvalid
-            if arr_sort.dtype.char in NumpyCharTypes.Integer:
-                valid = arr_sort[notvalid:-1]
-            else:
-                valid = arr_sort[0:cvalid]
-
         # this interpolate call is the same as numpy.percentile, which doesn't exist until a recent version of numpy
         # ## interpolate( data, pp / 100.0 * ( len( data ) - 1 ) ) == percentile( data, pp ) for pp \in [ 0, 100 ]
-        # it also avoids multiple sorts...
+        # a full sort is not needed, only the positions interpolate reads have to be in sorted order
         cvalidm1 =  cvalid -1
 
-        # calculate the quantiles
-        quantiles=[]
-        for percent in q:
-            interp, _ = interpolate(valid, percent * cvalidm1)
-            quantiles.append(interp)
+        #inplace partition
+        _partial_sort(valid, _interpolate_kth(q, cvalidm1))
 
-        retvals = quantiles
+        # calculate the quantiles
+        retvals = _quantiles_from_sorted_or_partitioned(valid, q)
         # help recycler
-        del arr_sort
-    return TypeRegister.FastArray(retvals, dtype=np.float64)
+        del valid
+    return retvals
 
 
 #----------------------------------------------------------
-def describe_helper(arr: Optional[np.ndarray], q: Optional[List[float]] = None) -> Union[List[str], np.ndarray]:
+@functools.lru_cache(maxsize=32)
+def _describe_labels(q: Tuple[float, ...]) -> Tuple[str, ...]:
     """
-    pass in None to get labels
-    otherwise returns an array matching the labels
+    The describe labels for the quantiles in `q`, cached since describe asks for them on every call.
+    Returned as a tuple so the cached value cannot be modified by callers.
     """
-    if q is None:
-        q = [0.10, 0.25, 0.50, 0.75, 0.90]
     preamble = 'Count Valid Nans Mean Std Min '
     body = ''
     for percent in q:
         body += 'P' + str(int(percent*100)) + ' '
     postamble = 'Max MeanM'
+    allstrings = preamble + body + postamble
+    return tuple(allstrings.split())
+
+#----------------------------------------------------------
+def describe_helper(arr: Optional[np.ndarray], q: Optional[List[float]] = None) -> Union[List[str], np.ndarray]:
+    """
+    pass in None to get labels
+    otherwise returns an array matching the labels
+    """
+    if q is None:
+        q = [0.10, 0.25, 0.50, 0.75, 0.90]
 
     # Do I want to allow for optionally adding more pctls?
     if arr is None:
-        allstrings = preamble + body + postamble
-        return allstrings.split()
-    ivalid = arr.isnotnan()
+        return list(_describe_labels(tuple(q)))
     count = len(arr)
-    cvalid = ivalid.sum()
+    # copy of the valid values
+    valid = _copy_valid(arr)
+    cvalid = len(valid)
+    nq = len(q)
+    # Count, Valid, Nans, Mean, Std, Min, <quantiles>, Max, MeanM
+    # NOTE: The 8 must be increased if we change code below
+    retvals = empty(8 + nq, dtype=np.float64)
+    retvals[0] = count
+    retvals[1] = cvalid
     if cvalid == 0:
-        # NOTE: The 6 must be increased if we change code below
-        retvals = [count, cvalid] + [np.nan] * (6 + len(q))
+        retvals[2:] = np.nan
     else:
-        # sort will put nans at end
-        # for signed integer sentinels, they will be in the beginning
-
-        # make a fast copy first
-        arr_sort = arr.copy()
-
-        #inplace sort
-        arr_sort.sort()
-
-        if cvalid == count:
-            # use entire array
-            valid = arr_sort
-            notvalid = 0
-        else:
-            # pick a subset removing the invalid
-            notvalid = count - cvalid
-            if arr_sort.dtype.char in NumpyCharTypes.Integer:
-                valid = arr_sort[notvalid:-1]
-            else:
-                valid = arr_sort[0:cvalid]
-
+        notvalid = count - cvalid
         # this interpolate call is the same as numpy.percentile, which doesn't exist until a recent version of numpy
         # ## interpolate( data, pp / 100.0 * ( len( data ) - 1 ) ) == percentile( data, pp ) for pp \in [ 0, 100 ]
-        # it also avoids multiple sorts...
+        # a full sort is not needed, only the positions read below have to be in sorted order:
+        # min, max, the quantiles and the P10/P90 bounds of the middle 80% (the slice between them is then
+        # also the right set of values for the trimmed mean)
         cvalidm1 =  cvalid -1
+
+        #inplace partition
+        _partial_sort(valid, _interpolate_kth(list(q) + [0.0, 0.10, 0.90, 1.0], cvalidm1))
+
         d1, d1break = interpolate(valid, 0.10 * cvalidm1)
         d9, d9break = interpolate(valid, 0.90 *  cvalidm1)
 
         # calculate the quantiles
-        quantiles=[]
-        for percent in q:
-            interp, _ = interpolate(valid, percent * cvalidm1)
-            quantiles.append(interp)
+        _quantiles_from_sorted_or_partitioned(valid, q, out=retvals[6:6 + nq])
 
         # get nice data in the middle 80%
         # the mean calculation includes the low which gets truncated
@@ -801,17 +1108,43 @@ def describe_helper(arr: Optional[np.ndarray], q: Optional[List[float]] = None)
         if d9break > cvalid:
             d9break = cvalid
 
-        validm = valid[d1break:d9break]
-
-        m0 = validm.mean() if len(validm) > 0 else np.nan
-        vmean = valid.mean()
-        retvals = [count, cvalid, notvalid, vmean, valid.std(),
-                   valid[0]]
-        retvals += quantiles
-        retvals += [valid[-1], m0]
+        # the quantile kths above bracket this window, so the partition already left it in place
+        # and the trimmed mean is a single reduction over that slice
+        nmiddle = d9break - d1break
+        m0 = valid[d1break:d9break].sum() / nmiddle if nmiddle > 0 else np.nan
+        retvals[2] = notvalid
+        retvals[3], retvals[4] = _mean_std(valid)
+        retvals[5] = valid[0]
+        retvals[6 + nq] = valid[-1]
+        retvals[7 + nq] = m0
         # help recycler
-        del arr_sort
-    return TypeRegister.FastArray(retvals, dtype=np.float64)
+        del valid
+    return retvals
+
+#--------------------------------------------------------------------------
+# Rows per column before describe() spreads the columns of a Dataset over a thread pool.
+# The partition, the valid-value compaction and the Welford kernel release the GIL; the per-column
+# Python overhead (interpolate, slicing, the trimmed-mean sum, allocations) does not. That overhead
+# is a few tens of us, about half a 1000 row column but under 10% of a 20000 row one.
+_DESCRIBE_THREADED_MIN_ROWS = 10000
+
+def _describe_dataset_threaded(ds: 'Dataset', q: List[float], fill_value=None) -> 'Dataset':
+    """
+    Same result as ``ds.reduce(describe_helper, q=q, as_dataset=True, fill_value=fill_value)``,
+    but the computable columns are described in a thread pool, see _DESCRIBE_THREADED_MIN_ROWS.
+    """
+    keys = list(ds.keys())
+    comp = [k for k in keys if ds.col_get_value(k).iscomputable()]
+    cols = [ds.col_get_value(k) for k in comp]
+    with ThreadPoolExecutor() as ex:
+        results = dict(zip(comp, ex.map(functools.partial(describe_helper, q=q), cols)))
+
+    if len(comp) < len(keys):
+        # the non-computable columns follow the fill_value rules of Dataset.reduce
+        noncomp = ds[[k for k in keys if k not in results]]
+        results.update(noncomp.reduce(describe_helper, q=q, as_dataset=True, fill_value=fill_value).items())
+
+    return type(ds)({k: results[k] for k in keys if k in results})
 
 #--------------------------------------------------------------------------
 def describe(arr, q: Optional[List[float]] = None, fill_value = None):
@@ -858,20 +1191,29 @@ def describe(arr, q: Optional[List[float]] = None, fill_value = None):
         # support for old code that might pass in None to get labels
         return describe_helper(None, q=q)
 
+    FastArray = TypeRegister.FastArray
+    Dataset = TypeRegister.Dataset
+
     # first call is to get labels we use
-    labels = TypeRegister.FastArray(describe_helper(None, q=q))
+    labels = FastArray(list(_describe_labels(tuple(q))))
     if not isinstance(fill_value, (list, np.ndarray, dict, type(None))):
         fill_value = [fill_value] * len(labels)
 
-    if isinstance(arr, TypeRegister.Dataset):
-        retval = arr.reduce(describe_helper, q=q, as_dataset=True, fill_value=fill_value)
+    if isinstance(arr, Dataset):
+        # wide datasets of long enough columns: describe the columns concurrently.
+        # (inside a worker each column is single threaded, but there are enough columns to keep every core busy)
+        ncpu = os.cpu_count() or 1
+        if ncpu > 1 and arr.get_ncols() >= ncpu and arr.get_nrows() >= _DESCRIBE_THREADED_MIN_ROWS:
+            retval = _describe_dataset_threaded(arr, q, fill_value=fill_value)
+        else:
+            retval = arr.reduce(describe_helper, q=q, as_dataset=True, fill_value=fill_value)
     else:
-        if not isinstance (arr, TypeRegister.FastArray):
-            arr = TypeRegister.FastArray(arr)
+        if not isinstance (arr, FastArray):
+            arr = FastArray(arr)
         name = arr.get_name()
         if name is None: name = 'Col0'
 
-        retval = TypeRegister.Dataset({name: describe_helper(arr)})
+        retval = Dataset({name: describe_helper(arr)})
 
     retval.Stats = labels
     retval.col_move_to_front(['Stats'])
@@ -918,13 +1260,26 @@ def is_list_like(obj):
             not isinstance(obj, (str, bytes)))
 
 #----------------------------------------------------------
+# INVALID_DICT as a list indexed directly by dtype.num
+# dtypes without an entry fall through to INVALID_DICT so they still raise a KeyError
+_NO_INVALID = object()
+_INVALID_BY_NUM = [INVALID_DICT.get(num, _NO_INVALID) for num in range(max(INVALID_DICT) + 1)]
+
 def get_default_value(arr):
     t = type(arr)
-    if isinstance(arr, np.ndarray):
+    # comparing the exact type is cheaper than the isinstance checks for the common arrays
+    if t is not np.ndarray and t is not TypeRegister.FastArray:
+        if not isinstance(arr, np.ndarray):
+            return np.nan
         if isinstance(arr, TypeRegister.Categorical):
             return arr.invalid_category
-        return INVALID_DICT[arr.dtype.num]
-    return np.nan
+
+    num = arr.dtype.num
+    if num < len(_INVALID_BY_NUM):
+        inv = _INVALID_BY_NUM[num]
+        if inv is not _NO_INVALID:
+            return inv
+    return INVALID_DICT[num]
 
 #----------------------------------------------------------
 def str_replace(arr, old, new, missing=''):
@@ -946,21 +1301,73 @@ def str_replace(arr, old, new, missing=''):
     New string array with replaced strings.
     """
 
-    for i in [arr, old, new]:
-        if isinstance(i, np.ndarray):
-            if i.dtype.char not in 'US':
-                raise TypeError(f"str_replace input must be arrays of strings")
-        else:
-            raise TypeError(f"str_replace input must be numpy array")
+    if not (isinstance(arr, np.ndarray) and isinstance(old, np.ndarray) and isinstance(new, np.ndarray)):
+        raise TypeError(f"str_replace input must be numpy array")
+    if arr.dtype.char not in 'US' or old.dtype.char not in 'US' or new.dtype.char not in 'US':
+        raise TypeError(f"str_replace input must be arrays of strings")
 
     if len(old) == len(new):
-        c = TypeRegister.Categorical(arr, old, invalid=missing)
-        d = TypeRegister.Categorical(c._fa, new, invalid=missing)
-        return d.expand_array
+        # strings are held as bytes where possible, same as a Categorical would
+        arr, old, new = (TypeRegister.FastArray(i)._np for i in (arr, old, new))
+        try:
+            if new.dtype.char == 'S' and isinstance(missing, str):
+                missing = missing.encode('ascii')
+        except UnicodeEncodeError:
+            pass
+
+        if arr.dtype.char != old.dtype.char or new.dtype.char != np.asarray(missing).dtype.char:
+            # mixed bytes/unicode that could not be converted, let Categorical sort it out
+            c = TypeRegister.Categorical(arr, old, invalid=missing)
+            d = TypeRegister.Categorical(c._fa, new, invalid=missing)
+            return d.expand_array
+
+        # one binary search into the sorted uniques instead of building two Categoricals
+        order = np.argsort(old)
+        sorted_old = old[order]
+        pos = np.searchsorted(sorted_old, arr)
+        if len(old) > 0:
+            # values past the end of old are not found either
+            pos[pos == len(old)] = 0
+            found = sorted_old[pos] == arr
+        else:
+            found = np.zeros(len(arr), dtype=bool)
+
+        result = np.full(len(arr), missing, dtype=np.result_type(new, np.asarray(missing)))
+        result[found] = new[order][pos[found]]
+        return TypeRegister.FastArray(result)
     else:
         raise ValueError(f"Lists of old uniques, new uniques must be the same length.")
 
 
+# -------------------------------------------------------
+def _floyd_sample(M: int, N: int) -> np.ndarray:
+    """
+    N distinct random integers from ``range(M)`` using Floyd's algorithm, O(N) time and memory regardless of M.
+    Draws from the global numpy random state, so ``np.random.seed`` still makes samples reproducible.
+    """
+    # one draw in [0, j] for each j in range(M-N, M); the default int dtype is 32 bit on windows
+    draws = np.random.randint(0, np.arange(M - N + 1, M + 1, dtype=np.int64), dtype=np.int64)
+    picked = set()
+    for j, t in zip(range(M - N, M), draws.tolist()):
+        picked.add(j if t in picked else t)
+    return np.fromiter(picked, dtype=np.int64, count=N)
+
+@nb.jit(nopython=True, nogil=True, cache=True)
+def _true_positions_nb(mask, ranks):
+    # positions of the ranks[j]-th True in mask, ranks unique and sorted
+    out = np.empty(ranks.shape[0], dtype=np.int64)
+    j = 0
+    seen = 0
+    for i in range(mask.shape[0]):
+        if j == ranks.shape[0]:
+            break
+        if mask[i]:
+            if ranks[j] == seen:
+                out[j] = i
+                j += 1
+            seen += 1
+    return out
+
 # -------------------------------------------------------
 def sample(obj, N: int=10, filter=None):
     """
@@ -980,15 +1387,30 @@ def sample(obj, N: int=10, filter=None):
     """
     if filter is None:
         M = obj.shape[0]
-        N = min(N, obj.shape[0])
+        poolsize = M
+    elif filter.dtype.char == '?':  # Bool
+        # the row numbers are only built below if most of them are needed
+        M = None
+        poolsize = int(np.count_nonzero(filter))
     else:
-        if filter.dtype.char == '?':  # Bool
+        M = filter
+        poolsize = M.shape[0]
+    N = min(N, poolsize)
+
+    if N * 10 < poolsize:
+        # the usual case of a few rows from a large pool, np.random.choice would permute the whole pool
+        idx = _floyd_sample(poolsize, N)
+        if M is None:
+            # pick the chosen Trues by rank in one scan, rather than building all the row numbers
+            idx.sort()
+            idx = _true_positions_nb(np.asarray(filter), idx)
+        elif filter is not None:
+            idx = M[idx]
+    else:
+        if M is None:
             M = bool_to_fancy(filter)
-        else:
-            M = filter
-        N = min(N, M.shape[0])
-    # np.random.choice accepts as M either an int, which implicitly means 1-M, or a list of numbers
-    idx = np.random.choice(M, N, replace=False)
+        # np.random.choice accepts as M either an int, which implicitly means 1-M, or a list of numbers
+        idx = np.random.choice(M, N, replace=False)
     idx.sort()
     if len(obj.shape) == 1:
         return obj[idx]
@@ -1019,11 +1441,26 @@ def crc_match(arrlist: List[np.ndarray]) -> bool:
     #   crc32c(FA([b'', b'abcdef'])) == crc32c(FA([b'abcdef']))
     # which will give an incorrect result (since the arrays actually aren't structurally equal).
 
+    # The dtype is compared too -- even if underlying data is identical, different dtypes means the data
+    # will be interpreted differently so the arrays aren't a match (e.g. bool vs. int8, signed vs. unsigned int).
+    # dtype.str is used rather than dtype.num since equivalent dtypes (e.g. 'l' and 'q' on linux) have different nums.
+
     # TODO: Also need to consider strides, at least until the CRC implementation respects them.
     #       Even then, we may want to calculate the CRC over the whole memory for performance reasons
     #       then use the strides here to disambiguate the results.
-    #       Also consider dtype -- even if underlying data is identical, different dtypes means the data
-    #       will be interpreted differently so the arrays aren't a match. Checking for shape already partially
-    #       accounts for this, but we need to check dtype explicitly to account for bool vs. int8 and signed vs. unsigned int.
-    crcs = {(arr.shape, crc32c(arr)) for arr in arrlist}
-    return len(crcs) == 1
+    if len(arrlist) == 0:
+        return False
+
+    # the structural checks are cheap, do them all before calculating any CRC
+    first = arrlist[0]
+    shape, dtype = first.shape, first.dtype.str
+    for arr in arrlist[1:]:
+        if arr.shape != shape or arr.dtype.str != dtype:
+            return False
+
+    # stop at the first mismatch
+    crc = crc32c(first)
+    for arr in arrlist[1:]:
+        if crc32c(arr) != crc:
+            return False
+    return True
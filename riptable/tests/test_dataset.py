@@ -3,6 +3,7 @@ import pytest
 import unittest
 import re
 import keyword
+import os
 import pandas as pd
 
 from collections import namedtuple
@@ -15,7 +16,7 @@ from riptable import Categorical
 from riptable import NumpyCharTypes
 from riptable import TimeSpan, utcnow, Date
 from riptable.rt_numpy import arange, isnan, tile, logical
-from riptable.rt_utils import describe
+from riptable.rt_utils import describe, describe_helper, _describe_dataset_threaded, _DESCRIBE_THREADED_MIN_ROWS
 from riptable.rt_enum import (
     INVALID_DICT,
     TypeRegister,
@@ -1593,6 +1594,37 @@ class TestDataset(unittest.TestCase):
         self.assertEqual(s._nrows, 50)
         self.assertTrue(bool(np.all(s.arr == 20)))
 
+        # few rows from a large filtered pool
+        ds.rownum = arange(200)
+        s = ds.sample(N=5, filter=f)
+        self.assertEqual(s._nrows, 5)
+        self.assertTrue(bool(np.all(s.arr == 20)))
+        self.assertEqual(len(np.unique(s.rownum)), 5)
+        self.assertTrue(bool(np.all(np.diff(s.rownum) > 0)))
+
+        # few rows, no filter
+        s = ds.sample(N=7)
+        self.assertEqual(s._nrows, 7)
+        self.assertEqual(len(np.unique(s.rownum)), 7)
+        self.assertTrue(bool(np.all(np.diff(s.rownum) > 0)))
+        self.assertTrue(0 <= s.rownum[0] and s.rownum[-1] < 200)
+
+        # few rows from row numbers
+        rows = arange(50, 150)
+        s = ds.sample(N=6, filter=rows)
+        self.assertEqual(s._nrows, 6)
+        self.assertEqual(len(np.unique(s.rownum)), 6)
+        self.assertTrue(bool(np.all(np.diff(s.rownum) > 0)))
+        self.assertTrue(50 <= s.rownum[0] and s.rownum[-1] < 150)
+
+        # reproducible under np.random.seed, on every path
+        for kwargs in [dict(N=7), dict(N=6, filter=rows), dict(N=5, filter=f), dict(N=50, filter=f)]:
+            np.random.seed(1234)
+            first = ds.sample(**kwargs).rownum
+            np.random.seed(1234)
+            second = ds.sample(**kwargs).rownum
+            assert_array_equal(first, second)
+
     def test_dataset_pandas(self):
         import pandas as pd
 
@@ -1716,6 +1748,25 @@ class TestDataset(unittest.TestCase):
         self.assertEqual(result[1], 0)
         self.assertTrue(bool(np.all(isnan(result[2:]))))
 
+    def test_describe_wide(self):
+        # enough columns and rows for describe to fan the columns out to a thread pool (given more than one cpu)
+        ncols = max(os.cpu_count() or 1, 2) + 2
+        nrows = _DESCRIBE_THREADED_MIN_ROWS
+        ds = Dataset({f'c{i}': arange(nrows) * (i + 0.5) for i in range(ncols)})
+        ds.s = FastArray(['a'] * nrows)
+        ds.c1[3] = np.nan
+        for fill_value in [None, -1.0]:
+            expected = ds.reduce(describe_helper, q=None, as_dataset=True, fill_value=fill_value)
+            res = _describe_dataset_threaded(ds, q=[0.10, 0.25, 0.50, 0.75, 0.90], fill_value=fill_value)
+            self.assertEqual(list(res.keys()), list(expected.keys()))
+            for k in expected.keys():
+                assert_array_almost_equal(res[k], expected[k])
+
+            res = describe(ds, fill_value=fill_value)
+            self.assertEqual(list(res.keys()), ['Stats'] + list(expected.keys()))
+            for k in expected.keys():
+                assert_array_almost_equal(res[k], expected[k])
+
     # Regression test for RIP-442 - Error displaying dataset with multiple 'key' columns with zero rows
     def test_repr_multikey_columns_with_zero_rows(self):
         ds = Dataset({
@@ -1,9 +1,15 @@
+import enum
+import re
+import sys
+import types
+from collections.abc import Iterable
+
 import pytest
 import numpy as np
 from numpy.testing import assert_array_equal
 
 import riptable as rt
-from riptable.rt_utils import crc_match
+from riptable.rt_utils import crc_match, findTrueWidth, h5io_to_struct, _floyd_sample, _possibly_convert_rec_array, _possibly_create_dataset, _mean_m2_nb, _mean_std, describe_helper, is_list_like, quantile, str_replace
 
 @pytest.mark.parametrize(
     "arrs,expected",
@@ -30,6 +36,14 @@ from riptable.rt_utils import crc_match
             False,
             id="ascii__ascii__leading-empty",
         ),
+        # Test cases for verifying array dtype is checked even when
+        # the underlying data (and its shape) is the same.
+        pytest.param(
+            [np.array([0, 1, 1], dtype=np.int8), np.array([False, True, True])], False, id="int8__bool"
+        ),
+        pytest.param(
+            [np.arange(5, dtype=np.int32), np.arange(5, dtype=np.uint32)], False, id="int32__uint32"
+        ),
     ],
 )
 def test_crc_match(arrs, expected):
@@ -37,6 +51,142 @@ def test_crc_match(arrs, expected):
     assert result == expected
 
 
+@pytest.mark.parametrize("width", [0, 1, 5, 8, 9, 16, 31, 64])
+def test_findTrueWidth(width):
+    for truewidth in range(width + 1):
+        arr = np.zeros(width, dtype=np.int8)
+        if truewidth > 0:
+            arr[:truewidth] = ord('a')
+            # embedded zeros must not be mistaken for the end of the string
+            arr[0] = 0
+            arr[truewidth - 1] = -1
+        if truewidth == 1:
+            arr[0] = -1
+        assert findTrueWidth(arr) == truewidth
+
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_possibly_convert_rec_array(copy):
+    recarr = np.zeros(7, dtype=[('a', np.int64), ('b', np.float32), ('c', 'S3')])
+    recarr['a'] = np.arange(7)
+    recarr['b'] = np.arange(7) / 2
+    recarr['c'] = b'abc'
+
+    result = _possibly_convert_rec_array(recarr, copy=copy)
+    assert list(result.keys()) == ['a', 'b', 'c']
+    for name, col in result.items():
+        assert col.dtype == recarr.dtype[name]
+        assert_array_equal(recarr[name], col)
+        assert np.shares_memory(recarr, col) != copy
+
+
+def test_possibly_create_dataset():
+    # lists and scalars are converted by the Dataset constructor
+    result = _possibly_create_dataset({'a': np.arange(3), 'b': [4, 5, 6]})
+    assert isinstance(result, rt.Dataset)
+    assert_array_equal(rt.FA([4, 5, 6]), result.b)
+    result = _possibly_create_dataset({'x': 5})
+    assert isinstance(result, rt.Dataset)
+    assert result.shape == (1, 1)
+
+    # arrays of different lengths and nested containers can only be a Struct
+    for itemdict in [
+        {'a': np.arange(3), 'b': np.arange(4)},
+        {'a': np.arange(3), 'b': {'c': np.arange(3)}},
+        {'a': np.arange(3), 'b': rt.Struct({'c': 1})},
+    ]:
+        result = _possibly_create_dataset(itemdict)
+        assert type(result) is rt.Struct
+        assert list(result.keys()) == ['a', 'b']
+
+
+def test_h5io_to_struct_order():
+    # stand-in for a class from the hdf5.io module
+    io_class = type('Thing', (), {'__module__': 'hdf5.io', 'version': np.arange(4)})
+    io = io_class()
+    io.zeta = np.arange(3)
+    io.alpha = np.arange(5.0)
+    io._hidden = np.arange(2)
+
+    result = h5io_to_struct(io)
+    # same columns and (sorted) order as dir(io), class attributes included
+    assert list(result.keys()) == ['alpha', 'version', 'zeta']
+    assert_array_equal(io_class.version, result.version)
+    assert_array_equal(io.zeta, result.zeta)
+
+
+def test_load_h5_lazy(tmpdir):
+    h5py = pytest.importorskip('h5py')
+    filename = str(tmpdir.join('lazy.h5'))
+    a = np.arange(100, dtype=np.int64)
+    b = np.arange(100) / 2.0
+    c = np.arange(100, dtype=np.int32)
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('a', data=a)
+        f.create_dataset('b', data=b)
+        # chunked and compressed, cannot be memory-mapped so it is read in full
+        f.create_dataset('c', data=c, chunks=(10,), compression='gzip')
+
+    ds = rt.load_h5(filename, lazy=True)
+    assert isinstance(ds, rt.Dataset)
+    assert list(ds.keys()) == ['a', 'b', 'c']
+    for name, expected in [('a', a), ('b', b), ('c', c)]:
+        assert ds[name].dtype == expected.dtype
+        assert_array_equal(expected, ds[name])
+    # the memory-mapped columns are read-only, the column read in full is not
+    assert not ds.a.flags.writeable
+    assert not ds.b.flags.writeable
+    assert ds.c.flags.writeable
+
+    ds = rt.load_h5(filename, lazy=True, columns=re.compile('^[ab]$'))
+    assert list(ds.keys()) == ['a', 'b']
+    ds = rt.load_h5(filename, lazy=True, columns=['c', 'a', 'missing'])
+    assert list(ds.keys()) == ['c', 'a']
+
+
+def test_load_h5_drop_short_skips_short_columns(tmpdir, monkeypatch):
+    h5py = pytest.importorskip('h5py')
+    filename = str(tmpdir.join('short.h5'))
+    data = {'a': np.arange(10), 'b': np.arange(10.0), 'c': np.arange(10, dtype=np.int8), 'short': np.arange(3)}
+    with h5py.File(filename, 'w') as f:
+        for k, v in data.items():
+            f.create_dataset(k, data=v)
+
+    # the hdf5 module used by load_h5 is not public, stand in for its load() with h5py
+    io_class = type('Thing', (), {'__module__': 'hdf5.io'})
+    requested = []
+
+    def fake_load(filepath, name='/', columns='', format=None, **kwargs):
+        requested.append(columns)
+        io = io_class()
+        with h5py.File(filepath, 'r') as f:
+            for k in columns or list(f[name].keys()):
+                setattr(io, k, f[name][k][()])
+        return io
+
+    hdf5 = types.ModuleType('hdf5')
+    hdf5.Format = types.SimpleNamespace(NDARRAY='ndarray')
+    hdf5.load = fake_load
+    monkeypatch.setitem(sys.modules, 'hdf5', hdf5)
+
+    ds = rt.load_h5(filename, drop_short=True)
+    # the short column is never read
+    assert requested == [['a', 'b', 'c']]
+
+    # same result as dropping the short columns after loading everything
+    full = h5io_to_struct(fake_load(filename))
+    expected = {k: v for k, v in full.items() if len(v) == 10}
+    assert isinstance(ds, rt.Dataset)
+    assert list(ds.keys()) == list(expected)
+    for k, v in expected.items():
+        assert_array_equal(v, ds[k])
+
+    requested.clear()
+    ds = rt.load_h5(filename, drop_short=True, columns=['short', 'b'])
+    assert requested == [['b']]
+    assert list(ds.keys()) == ['b']
+
+
 def test_mbget_no_default_uses_invalid():
     data = np.arange(start=3, stop=53, dtype=np.int8).view(rt.FA)
     indices = rt.FA([0, 25, -40, 17, 100, -80, 50, -51, 35])
@@ -125,3 +275,180 @@ def test_mbget_with_non_FA_subclass():
     # Check that the valid indices fetched the correct values.
     assert_array_equal(rt.FA([3, 28, 13, 20, 38]), result[valid_indices])
     assert type(data) == np.ndarray
+
+
+@pytest.mark.parametrize("order", ['C', 'F'])
+def test_mbget_2dims(order):
+    data = np.asarray(np.arange(20, dtype=np.int32).reshape(5, 4), order=order)
+    indices = rt.FA([0, 4, 5, -1, -5, -6, 2, 100])
+
+    valid_indices = np.logical_and(indices >= -5, indices < 5)
+
+    result = rt.mbget(data, indices)
+    assert result.shape == (len(indices), data.shape[1])
+    assert np.isfortran(result) == (order == 'F')
+
+    # out-of-bounds rows must not wrap into a neighbouring column for fortran layout
+    assert_array_equal(np.repeat(valid_indices, 4).reshape(-1, 4), rt.isnotnan(result))
+    assert_array_equal(data[indices[valid_indices]], result[valid_indices])
+
+
+@pytest.mark.parametrize("dtype", [np.int32, np.uint16, np.float64])
+def test_quantile_and_describe_helper_drop_invalid(dtype):
+    values = np.array([7, 3, 11, 1, 5, 9, 2, 13, 8, 4, 10], dtype=dtype)
+    arr = rt.FA(np.insert(values, [1, 4, 4, 9], 0))
+    arr[[1, 5, 6, 12]] = arr.inv
+    q = [0.10, 0.25, 0.50, 0.75, 0.90]
+
+    expected_quantiles = np.percentile(values.astype(np.float64), [p * 100 for p in q])
+    assert_array_equal(expected_quantiles, quantile(arr, q))
+
+    result = describe_helper(arr, q)
+    labels = describe_helper(None, q)
+    stats = dict(zip(labels, result))
+    assert stats['Count'] == len(arr)
+    assert stats['Valid'] == len(values)
+    assert stats['Nans'] == len(arr) - len(values)
+    assert stats['Min'] == values.min()
+    assert stats['Max'] == values.max()
+    assert_array_equal(expected_quantiles, result[6:6 + len(q)])
+
+
+def test_quantile_non_native_byteorder():
+    # e.g. from np.frombuffer or h5 data; numba cannot type these, so they take the isnotnan() path
+    values = np.array([7, 3, np.nan, 1, 5, 9, 2, np.nan, 8], dtype='>f8')
+    q = [0.10, 0.50, 0.90]
+    expected = np.nanpercentile(values.astype(np.float64), [p * 100 for p in q])
+    assert_array_equal(expected, quantile(values.view(rt.FA), q))
+
+    result = describe_helper(values.view(rt.FA), q)
+    valid = values[~np.isnan(values)]
+    assert result[3] == pytest.approx(valid.mean())
+    assert result[4] == pytest.approx(valid.std(ddof=1))
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32, np.int64, np.int16])
+@pytest.mark.parametrize("n", [300_000, 300_007, 1, 2, 7])
+def test_mean_std(dtype, n):
+    # large enough to split into chunks that are merged afterwards; 300_007 leaves a short last chunk
+    rng = np.random.default_rng(n)
+    values = (rng.normal(size=n) * 1000 + 50).astype(dtype)
+    mean, std = _mean_std(values.view(rt.FA))
+    assert mean == pytest.approx(np.mean(values, dtype=np.float64), rel=1e-9)
+    if n > 1:
+        assert std == pytest.approx(np.std(values, dtype=np.float64, ddof=1), rel=1e-9)
+    else:
+        assert np.isnan(std)
+
+    # the chunk merge, whatever the number of numba threads
+    for nchunks in [3, 8]:
+        mean, m2 = _mean_m2_nb(values, nchunks)
+        assert mean == pytest.approx(np.mean(values, dtype=np.float64), rel=1e-9)
+        assert m2 == pytest.approx(np.var(values, dtype=np.float64) * n, rel=1e-9, abs=1e-9)
+
+
+@pytest.mark.parametrize("values", [
+    [np.inf, 1.0, 2.0],
+    [1.0, np.inf, 2.0],
+    [1.0, 2.0, -np.inf],
+    [-np.inf, 1.0, np.inf],
+    [np.inf],
+])
+def test_mean_std_non_finite(values):
+    # same as numpy, not the nan an inf would leave in the Welford update
+    values = np.array(values)
+    expected_mean = np.mean(values)
+    expected_std = np.std(values, ddof=1) if len(values) > 1 else np.nan
+    mean, std = _mean_std(values.view(rt.FA))
+    assert_array_equal(expected_mean, mean)
+    assert_array_equal(expected_std, std)
+
+    # inf is a valid value for describe, only nan is dropped
+    arr = rt.FA(np.append(values, np.nan))
+    stats = dict(zip(describe_helper(None), describe_helper(arr)))
+    assert stats['Valid'] == len(values)
+    assert_array_equal(expected_mean, stats['Mean'])
+    assert_array_equal(expected_std, stats['Std'])
+
+
+def test_mean_std_non_finite_chunked():
+    # an inf in the middle of one chunk of a large array
+    values = np.arange(300_007, dtype=np.float64)
+    values[200_000] = -np.inf
+    mean, std = _mean_std(values.view(rt.FA))
+    assert mean == -np.inf
+    assert np.isnan(std)
+
+
+def test_floyd_sample_large_pool():
+    # pools past the int32 range, the default randint dtype on windows
+    M = 2**40
+    result = _floyd_sample(M, 20)
+    assert result.dtype == np.int64
+    assert len(np.unique(result)) == 20
+    assert 0 <= result.min() and result.max() < M
+
+
+class _Color(enum.Enum):
+    RED = 1
+
+
+class _IterMeta(type):
+    def __iter__(cls):
+        return iter([])
+
+
+class _WithIterMeta(metaclass=_IterMeta):
+    pass
+
+
+class _Registered:
+    pass
+
+
+Iterable.register(_Registered)
+
+
+class _NotIterable:
+    __iter__ = None
+
+
+@pytest.mark.parametrize(
+    "obj,expected",
+    [
+        ([1, 2], True),
+        ({1, 2}, True),
+        ((1, 2), True),
+        (np.arange(3), True),
+        (rt.FA([1, 2]), True),
+        (iter([1]), True),
+        (_Registered(), True),
+        ('abc', False),
+        (b'abc', False),
+        (1, False),
+        (None, False),
+        # the metaclass of an Enum defines __iter__, the members are not iterable
+        (_Color.RED, False),
+        (_WithIterMeta(), False),
+        (_NotIterable(), False),
+    ]
+)
+def test_is_list_like(obj, expected):
+    assert is_list_like(obj) == expected
+
+
+def test_str_replace():
+    arr = rt.FA(['a', 'b', 'zz', 'c', 'a'])
+    old = rt.FA(['c', 'a', 'b'])
+    new = rt.FA(['C', 'A', 'BBB'])
+
+    result = str_replace(arr, old, new, missing='miss')
+    assert_array_equal(rt.FA(['A', 'BBB', 'miss', 'C', 'A']), result)
+    assert result.dtype.char == 'S'
+
+    with pytest.raises(TypeError):
+        str_replace(arr, ['c', 'a', 'b'], new)
+    with pytest.raises(TypeError):
+        str_replace(arr, rt.FA([1, 2, 3]), new)
+    with pytest.raises(ValueError):
+        str_replace(arr, old, new[:2])